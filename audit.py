@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+
+
+class AuditWriter:
+    """Buffer audit events in memory and write them in batches"""
+
+    def __init__(self, db, batch_size=50, flush_interval=2.0,
+                 max_buffer=10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def log(self, user_id, action, details=""):
+        """Queue an audit event; it is written on the next flush"""
+        self._ensure_started()
+        self._queue.put((user_id, action, details))
+
+    def flush(self, timeout=None):
+        """Block until every event queued so far has been written"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Drain the queue and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self.flush(timeout)
+        self._thread.join(timeout)
+        self._thread = None
+        self._stopping = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="audit-writer",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        waiters = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            timeout = max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            due = time.monotonic() >= deadline
+            if batch and (waiters or due or len(batch) >= self.batch_size):
+                if self._write(batch):
+                    batch = []
+                elif len(batch) > self.max_buffer:
+                    print(f"Dropping {len(batch) - self.max_buffer} audit events")
+                    batch = batch[-self.max_buffer:]
+
+            if waiters and (not batch or self._stopping):
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+                if self._stopping and self._queue.empty():
+                    if batch:
+                        print(f"Discarding {len(batch)} unwritten audit events")
+                    return
+
+            if due:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch):
+        try:
+            conn = self.db.get_connection('audit_write')
+        except Exception as e:
+            print(f"Error writing audit log: {e}")
+            return False
+
+        try:
+            cur = conn.cursor()
+            cur.executemany(
+                """
+                INSERT INTO audit_log (user_id, action, details)
+                VALUES (%s, %s, %s)
+            """, batch)
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error writing audit log: {e}")
+            return False
+        finally:
+            cur.close()
+            self.db.return_connection(conn)
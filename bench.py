@@ -0,0 +1,280 @@
+"""Headless load generator for the form approval workflow.
+
+Simulates N desktop clients, each with its own DatabaseManager, running the
+same login, inbox, submit and approval code paths as the GUI against MySQL
+or a SQLite stand-in. Results are written as JSON so runs can be compared.
+
+Example:
+    python bench.py --database-url sqlite:///bench.db --clients 50 \
+        --duration 60 --roles "Initiator=1,User=2,Approver=1,Production Head=1"
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from database import DatabaseManager
+from hashing import PasswordHasher
+from workflow import STEP_MAPPING, WorkflowService
+
+BENCH_PASSWORD = 'bench-password'
+
+
+def parse_role_mix(text):
+    mix = {}
+    for part in text.split(','):
+        role, _, weight = part.partition('=')
+        mix[role.strip()] = float(weight or 1)
+    unknown = set(mix) - set(STEP_MAPPING) - {'Initiator'}
+    if unknown:
+        raise ValueError(f"Unknown roles in mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def assign_roles(clients, mix):
+    roles = []
+    total = sum(mix.values())
+    for role, weight in mix.items():
+        roles.extend([role] * round(clients * weight / total))
+    # Rounding may leave us a client short or over
+    while len(roles) < clients:
+        roles.append(max(mix, key=mix.get))
+    return roles[:clients]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collects latencies and errors per operation across client threads"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.approvals = 0
+        self.conflicts = 0
+        self.pool = {'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def time(self, operation, func, *args):
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.error(operation, e)
+            return None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(elapsed)
+        return result
+
+    def error(self, operation, error):
+        with self._lock:
+            counts = self.errors.setdefault(operation, {})
+            name = type(error).__name__
+            counts[name] = counts.get(name, 0) + 1
+
+    def decision(self, handled):
+        with self._lock:
+            if handled:
+                self.approvals += 1
+            elif handled is False:
+                self.conflicts += 1
+
+    def add_pool_stats(self, stats):
+        with self._lock:
+            self.pool['checkouts'] += stats['checkouts']
+            self.pool['wait_seconds'] += stats['wait_seconds']
+            self.pool['max_wait_seconds'] = max(self.pool['max_wait_seconds'],
+                                                stats['max_wait_seconds'])
+
+    def summary(self):
+        operations = {}
+        for operation in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(operation, []))
+            operations[operation] = {
+                'count': len(values),
+                'errors': self.errors.get(operation, {}),
+                'p50_ms': _ms(percentile(values, 50)),
+                'p95_ms': _ms(percentile(values, 95)),
+                'p99_ms': _ms(percentile(values, 99)),
+                'max_ms': _ms(values[-1] if values else None),
+            }
+        return operations
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def prepare(database_url, roles, seed_forms, hasher):
+    """Create one bench user per client and some forms to work on"""
+    db = DatabaseManager(database_url, hasher=hasher)
+    if not db.is_connected():
+        raise RuntimeError(f"Could not connect to {database_url}")
+
+    # Hashed at the configured cost so logins measure real verification
+    # and don't trigger a rehash. This also starts the hashing workers
+    # before the clients log in.
+    password_hash = hasher.hash(BENCH_PASSWORD)
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    users = []
+    with db.unit_of_work('bench_setup') as uow:
+        for index, role in enumerate(roles):
+            username = f"bench_{run_id}_{index}"
+            uow.execute(
+                """
+                INSERT INTO users (username, password_hash, role, email)
+                VALUES (%s, %s, %s, %s)
+            """, (username, password_hash, role, None))
+            users.append((username, role))
+
+        uow.execute("SELECT id FROM users WHERE username = %s",
+                    (users[0][0], ))
+        creator_id = uow.fetchone()[0]
+        # Spread the seed forms over the reviewer steps
+        steps = sorted(STEP_MAPPING.values())
+        uow.executemany(
+            """
+            INSERT INTO forms (title, description, form_data, created_by, current_step)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(f"Bench form {n}", "Seeded by bench.py",
+               json.dumps({'n': n}), creator_id, steps[n % len(steps)])
+              for n in range(seed_forms)])
+    db.close()
+    return users
+
+
+def run_client(database_url, replica_urls, pool_size, username, role, deadline,
+               think_time, batch_size, recorder, hasher):
+    db = DatabaseManager(database_url,
+                         pool_size=pool_size,
+                         replica_urls=replica_urls,
+                         hasher=hasher)
+    if not db.is_connected():
+        recorder.error('connect', RuntimeError("connect failed"))
+        return
+    workflow = WorkflowService(db)
+
+    try:
+        user = recorder.time('login', workflow.login, username,
+                             BENCH_PASSWORD)
+        if not user:
+            return
+
+        known_ids = set()
+        watermark = None
+        iteration = 0
+        while time.monotonic() < deadline:
+            iteration += 1
+            if role == 'Initiator':
+                recorder.time('submit_form', workflow.submit_form, user,
+                              f"{username} form {iteration}", "bench",
+                              {'iteration': iteration})
+                recorder.time('my_forms', workflow.list_my_forms, user)
+            else:
+                result = recorder.time('inbox', workflow.list_inbox, user,
+                                       watermark, known_ids, batch_size, 60)
+                if result:
+                    known_ids, rows = result
+                    for row in rows:
+                        if watermark is None or row[6] > watermark:
+                            watermark = row[6]
+                    if known_ids:
+                        form_id = random.choice(sorted(known_ids))
+                        action = 'rejected' if random.random() < 0.1 else 'approved'
+                        handled = recorder.time('approve', workflow.decide,
+                                                user, form_id, action,
+                                                "bench")
+                        recorder.decision(handled)
+
+            time.sleep(random.uniform(0, 2 * think_time))
+
+        recorder.time('logout', workflow.logout, user)
+    finally:
+        db.close()
+        recorder.add_pool_stats(db.pool_stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--replica-urls', default='',
+                        help="comma separated read replica URLs")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=60,
+                        help="seconds to run after all clients start")
+    parser.add_argument('--roles',
+                        default="Initiator=1,User=2,Approver=1,Production Head=1",
+                        help="role=weight pairs, comma separated")
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help="mean seconds between a client's actions")
+    parser.add_argument('--pool-size', type=int, default=2,
+                        help="connections per simulated client")
+    parser.add_argument('--batch-size', type=int, default=20,
+                        help="forms claimed per inbox refresh")
+    parser.add_argument('--seed-forms', type=int, default=500)
+    parser.add_argument('--output', help="write JSON results here")
+    args = parser.parse_args(argv)
+
+    roles = assign_roles(args.clients, parse_role_mix(args.roles))
+    replica_urls = [url for url in args.replica_urls.split(',') if url]
+    # One set of hashing workers for every client; a pool per client would
+    # start clients x cores processes and measure their startup instead
+    hasher = PasswordHasher()
+    users = prepare(args.database_url, roles, args.seed_forms, hasher)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(target=run_client,
+                         args=(args.database_url, replica_urls,
+                               args.pool_size, username, role, deadline,
+                               args.think_time, args.batch_size, recorder,
+                               hasher),
+                         daemon=True) for username, role in users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    hasher.close()
+
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': vars(args),
+        'role_counts': {role: roles.count(role) for role in sorted(set(roles))},
+        'elapsed_seconds': round(elapsed, 3),
+        'approvals': recorder.approvals,
+        'conflicts': recorder.conflicts,
+        'approvals_per_second': round(recorder.approvals / elapsed, 3),
+        'pool': {
+            'checkouts': recorder.pool['checkouts'],
+            'total_wait_seconds': round(recorder.pool['wait_seconds'], 3),
+            'mean_wait_ms': _ms(recorder.pool['wait_seconds'] /
+                                recorder.pool['checkouts'])
+            if recorder.pool['checkouts'] else None,
+            'max_wait_ms': _ms(recorder.pool['max_wait_seconds']),
+        },
+        'operations': recorder.summary(),
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
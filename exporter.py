@@ -0,0 +1,207 @@
+"""Streaming exports of the audit log, approvals and forms.
+
+Rows are read through DatabaseManager.stream, which uses an unbuffered
+cursor and fetchmany, and written straight to CSV or JSON lines (gzipped
+if the file name ends in .gz). Memory use stays the same however many rows
+are exported. Time ranges are served by the (time, id) indexes.
+
+Example:
+    python exporter.py audit_log --database-url sqlite:///forms.db \
+        --since 2024-01-01 --until 2024-07-01 --output audit_2024h1.csv.gz
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from database import DatabaseManager
+
+EXPORT_BATCH_SIZE = 2000
+
+# name: (columns, query, time column used for --since/--until)
+EXPORTS = {
+    'audit_log': (
+        ('id', 'username', 'action', 'details', 'timestamp'),
+        """
+        SELECT a.id, u.username, a.action, a.details, a.timestamp
+        FROM audit_log a
+        LEFT JOIN users u ON a.user_id = u.id
+        {where}
+        ORDER BY a.timestamp, a.id
+        """, 'a.timestamp'),
+    'approvals': (
+        ('id', 'form_id', 'form_title', 'username', 'step_number', 'action',
+         'comments', 'timestamp'),
+        """
+        SELECT p.id, p.form_id, f.title, u.username, p.step_number, p.action,
+               p.comments, p.timestamp
+        FROM approvals p
+        JOIN forms f ON p.form_id = f.id
+        JOIN users u ON p.user_id = u.id
+        {where}
+        ORDER BY p.timestamp, p.id
+        """, 'p.timestamp'),
+    'forms': (
+        ('id', 'title', 'description', 'form_data', 'created_by',
+         'current_status', 'current_step', 'created_at', 'updated_at'),
+        """
+        SELECT f.id, f.title, f.description, f.form_data, u.username,
+               f.current_status, f.current_step, f.created_at, f.updated_at
+        FROM forms f
+        JOIN users u ON f.created_by = u.id
+        {where}
+        ORDER BY f.updated_at, f.id
+        """, 'f.updated_at'),
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportProgress:
+
+    def __init__(self):
+        self.rows = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def rate(self):
+        """Rows written per second"""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return f"{self.rows} rows, {self.rate():.0f} rows/s"
+
+
+def parse_time(text):
+    return datetime.fromisoformat(text) if text else None
+
+
+def build_query(name, since=None, until=None):
+    """(columns, query, params) for export name over [since, until)"""
+    columns, query, time_column = EXPORTS[name]
+    conditions = []
+    params = []
+    if since:
+        conditions.append(f"{time_column} >= %s")
+        params.append(since)
+    if until:
+        conditions.append(f"{time_column} < %s")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return columns, query.format(where=where), tuple(params)
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def export(db, name, path, since=None, until=None,
+           batch_size=EXPORT_BATCH_SIZE, on_batch=None, cancel=None,
+           user=None):
+    """Write export name to path as CSV or JSON lines, chosen by extension
+
+    on_batch(progress) is called after every batch and setting the cancel
+    event stops the export. The file only appears at path once complete.
+    """
+    progress = ExportProgress()
+    columns, query, params = build_query(name, since, until)
+    compress = path.endswith('.gz')
+    as_csv = (path[:-3] if compress else path).endswith('.csv')
+
+    temp_path = path + '.part'
+    batches = db.stream(query, params, name=f"export_{name}",
+                        batch_size=batch_size, read_only=True)
+    completed = False
+    try:
+        with _open_output(temp_path, compress) as f:
+            if as_csv:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+            for rows in batches:
+                if cancel is not None and cancel.is_set():
+                    raise ExportCancelled(
+                        f"Export cancelled after {progress.rows} rows")
+                if as_csv:
+                    writer.writerows(rows)
+                else:
+                    f.writelines(
+                        json.dumps(dict(zip(columns, row, strict=True)),
+                                   default=str) + '\n'
+                        for row in rows)
+                progress.rows += len(rows)
+                if on_batch:
+                    on_batch(progress)
+        os.replace(temp_path, path)
+        completed = True
+    finally:
+        progress.finished = time.monotonic()
+        try:
+            batches.close()
+        finally:
+            if not completed and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    if user:
+        db.log_action(user['id'], f"Exported {name}",
+                      f"{progress.rows} rows to {os.path.basename(path)}")
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('name', choices=sorted(EXPORTS))
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--output', required=True,
+                        help=".csv or .jsonl, optionally followed by .gz")
+    parser.add_argument('--since', type=parse_time,
+                        help="first timestamp to include (ISO format)")
+    parser.add_argument('--until', type=parse_time,
+                        help="timestamp to stop before (ISO format)")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument('--as-user',
+                        help="record the export in the audit log as this user")
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.database_url)
+    if not db.is_connected():
+        print(f"Could not connect to {args.database_url}")
+        return 1
+
+    user = None
+    if args.as_user:
+        row = db.fetch_one("SELECT id FROM users WHERE username = %s",
+                           (args.as_user, ))
+        if row is None:
+            print(f"No such user: {args.as_user}")
+            db.close()
+            return 1
+        user = {'id': row[0]}
+
+    last_report = [time.monotonic()]
+
+    def on_batch(progress):
+        # About once a second
+        if time.monotonic() - last_report[0] >= 1:
+            last_report[0] = time.monotonic()
+            print(progress.summary())
+
+    try:
+        progress = export(db, args.name, args.output, args.since, args.until,
+                          args.batch_size, on_batch, user=user)
+        print(f"Exported {progress.summary()} to {args.output}")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
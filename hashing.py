@@ -0,0 +1,144 @@
+"""bcrypt hashing and verification on a process pool.
+
+bcrypt is deliberately slow, so hashing on a worker process keeps the
+calling thread (and its GIL) free and lets bulk work use every core. The
+cost factor comes from BCRYPT_ROUNDS or can be calibrated for a target
+latency on this machine:
+
+    python hashing.py --target-ms 250
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+DEFAULT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'),
+                          password_hash.encode('utf-8'))
+
+
+def hash_rounds(password_hash):
+    """Cost factor of a '$2b$12$...' hash"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def calibrate(target_ms=250, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Highest cost whose hash takes no longer than target_ms here"""
+    started = time.perf_counter()
+    _hash('calibration', min_rounds)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rounds = min_rounds
+    # Each extra round doubles the work
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+class PasswordHasher:
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, max_workers=None):
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+        self._inline = False
+        # Guards starting and tearing down the pool across caller threads
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None and not self._inline:
+                try:
+                    # spawn, not fork: the GUI and the pools have threads
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+                except (OSError, NotImplementedError) as e:
+                    print(f"Hashing in-process, no process pool available: {e}")
+                    self._inline = True
+            return self._pool
+
+    def _broken(self, pool, error):
+        with self._lock:
+            # Another thread may already have given up on this pool
+            if self._pool is not pool:
+                return
+            # Typically a script without an `if __name__ == "__main__"`
+            # guard, which spawned workers can't import
+            print(f"Hashing in-process, process pool failed: {error}")
+            self._pool = None
+            self._inline = True
+        pool.shutdown(wait=False)
+
+    def _call(self, func, *args):
+        pool = self._executor()
+        if pool is not None:
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool as e:
+                self._broken(pool, e)
+        return func(*args)
+
+    def hash(self, password):
+        return self._call(_hash, password, self.rounds)
+
+    def hash_many(self, passwords):
+        """Hash passwords in parallel, preserving order"""
+        pool = self._executor()
+        if pool is not None:
+            try:
+                return list(pool.map(_hash, passwords,
+                                     [self.rounds] * len(passwords)))
+            except BrokenProcessPool as e:
+                self._broken(pool, e)
+        return [_hash(password, self.rounds) for password in passwords]
+
+    def verify(self, password, password_hash):
+        return self._call(_check, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        return hash_rounds(password_hash) < self.rounds
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pick a bcrypt cost factor for this machine")
+    parser.add_argument('--target-ms', type=float, default=250,
+                        help="longest acceptable time for one hash")
+    args = parser.parse_args(argv)
+
+    rounds = calibrate(args.target_ms)
+    started = time.perf_counter()
+    _hash('calibration', rounds)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"BCRYPT_ROUNDS={rounds}  # {elapsed_ms:.0f} ms per hash")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,480 @@
+"""Bulk imports from CSV or JSON-lines files.
+
+Files are read as a stream and written in chunks: each chunk is validated,
+checked against what the database already has and inserted with one
+executemany in one transaction. Rows that can't be imported are collected
+in a report with their line numbers instead of stopping the run.
+
+Forms imports commit a checkpoint with every batch and can be resumed
+after an interruption.
+
+Examples:
+    python importers.py users --database-url sqlite:///forms.db \
+        --as-user admin operators.csv --errors operators.errors.csv
+    python importers.py forms --database-url sqlite:///forms.db \
+        --as-user admin legacy_forms.jsonl --resume
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from database import DatabaseManager
+from resilience import describe_error
+from workflow import ROLES, STEP_MAPPING
+
+USER_CHUNK_SIZE = 200
+# MySQL errors for a row that breaks a constraint: ER_DUP_ENTRY,
+# ER_BAD_NULL_ERROR and the foreign key errors
+INTEGRITY_ERRNOS = {1062, 1048, 1216, 1217, 1451, 1452}
+USERNAME_MAX_LENGTH = 50
+EMAIL_MAX_LENGTH = 100
+
+FORM_BATCH_SIZE = 1000
+TITLE_MAX_LENGTH = 255
+FORM_STATUSES = ('pending', 'approved', 'rejected')
+LAST_STEP = max(STEP_MAPPING.values())
+
+
+def read_records(path):
+    """Yield (line_number, record, error) for each row of a .csv or .jsonl file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, record, None
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+            yield line_number, record, None
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportReport:
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+    def rate(self):
+        """Rows read per second so far"""
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        text = (f"Imported {self.imported} of {self.rows} rows from "
+                f"{self.path}, {len(self.errors)} rejected")
+        if self.skipped:
+            text += f", {self.skipped} already imported"
+        return text
+
+    def write_errors(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', 'error'])
+            writer.writerows(sorted(self.errors))
+
+
+def _clean(record, field):
+    value = record.get(field)
+    return value.strip() if isinstance(value, str) else value
+
+
+def validate_user(record):
+    """Return ((username, password, role, email), None) or (None, error)"""
+    username = _clean(record, 'username')
+    password = record.get('password')
+    role = _clean(record, 'role')
+    email = _clean(record, 'email') or None
+    if not username or not password or not role:
+        return None, "username, password and role are required"
+    if len(username) > USERNAME_MAX_LENGTH:
+        return None, f"username is longer than {USERNAME_MAX_LENGTH} characters"
+    if role not in ROLES:
+        return None, f"Unknown role: {role}"
+    if email and ('@' not in email or len(email) > EMAIL_MAX_LENGTH):
+        return None, f"Invalid email: {email}"
+    return (username, str(password), role, email), None
+
+
+def _is_integrity_error(error):
+    return (isinstance(error, sqlite3.IntegrityError)
+            or getattr(error, 'errno', None) in INTEGRITY_ERRNOS)
+
+
+def _existing_usernames(db, usernames):
+    """The lowercased usernames that are already taken"""
+    # MySQL's collation already ignores case; SQLite has to be told
+    column = 'username'
+    if db.backend.name == 'sqlite':
+        column = 'username COLLATE NOCASE'
+    placeholders = ', '.join(['%s'] * len(usernames))
+    rows = db.fetch_all(
+        f"SELECT username FROM users WHERE {column} IN ({placeholders})",
+        tuple(usernames), name='import_users_existing')
+    return {row[0].lower() for row in rows}
+
+
+INSERT_USER = """
+    INSERT INTO users (username, password_hash, role, email)
+    VALUES (%s, %s, %s, %s)
+"""
+
+
+def _insert_users(db, user, rows, path):
+    with db.unit_of_work('import_users') as uow:
+        uow.executemany(INSERT_USER, rows)
+        db.log_action(user['id'], "Imported users",
+                      f"{len(rows)} users from {path}", cursor=uow)
+
+
+def _insert_users_singly(db, user, rows, path):
+    """Insert rows one statement at a time and return {index: error} for
+    the rows the database refused; the rest are committed"""
+    failed = {}
+    with db.unit_of_work('import_users') as uow:
+        for index, row in enumerate(rows):
+            try:
+                uow.execute(INSERT_USER, row)
+            except Exception as e:
+                # Only the failed statement is rolled back
+                if not _is_integrity_error(e):
+                    raise
+                failed[index] = e
+        if len(failed) < len(rows):
+            db.log_action(user['id'], "Imported users",
+                          f"{len(rows) - len(failed)} users from {path}",
+                          cursor=uow)
+    return failed
+
+
+def import_users(db, user, path, chunk_size=USER_CHUNK_SIZE, progress=None):
+    """Create the users listed in path on behalf of user, chunk by chunk
+
+    Columns are username, password, role and optionally email. Passwords
+    are hashed in parallel on the database manager's hashing pool.
+    """
+    report = ImportReport(path)
+    seen = set()
+    for chunk in chunked(read_records(path), chunk_size):
+        valid = []
+        for line_number, record, error in chunk:
+            report.rows += 1
+            if error is None:
+                row, error = validate_user(record)
+            # Usernames are unique regardless of case, as in MySQL
+            if error is None and row[0].lower() in seen:
+                error = f"Duplicate username in file: {row[0]}"
+            if error is not None:
+                report.error(line_number, error)
+                continue
+            seen.add(row[0].lower())
+            valid.append((line_number, row))
+
+        if valid:
+            existing = _existing_usernames(db, [row[0] for _, row in valid])
+            for line_number, row in valid:
+                if row[0].lower() in existing:
+                    report.error(line_number, f"User already exists: {row[0]}")
+            valid = [(line_number, row) for line_number, row in valid
+                     if row[0].lower() not in existing]
+
+        if valid:
+            hashes = db.hasher.hash_many([row[1] for _, row in valid])
+            rows = [(row[0], password_hash, row[2], row[3])
+                    for (_, row), password_hash in zip(valid, hashes,
+                                                       strict=True)]
+            try:
+                try:
+                    db.run(_insert_users, db, user, rows, path)
+                    report.imported += len(rows)
+                except Exception as e:
+                    if not _is_integrity_error(e):
+                        raise
+                    # One bad row rolled back its chunk; find which one
+                    failed = db.run(_insert_users_singly, db, user, rows, path)
+                    for index, error in failed.items():
+                        report.error(valid[index][0], describe_error(error))
+                    report.imported += len(rows) - len(failed)
+            except Exception as e:
+                message = describe_error(e)
+                for line_number, _ in valid:
+                    report.error(line_number, message)
+
+        if progress:
+            progress(report)
+    return report
+
+
+def validate_form(record):
+    """Return ((title, description, form_data_json, creator, status, step,
+    created_at), None) or (None, error); creator is a username or None"""
+    title = _clean(record, 'title')
+    if not title:
+        return None, "title is required"
+    if len(title) > TITLE_MAX_LENGTH:
+        return None, f"title is longer than {TITLE_MAX_LENGTH} characters"
+
+    form_data = record.get('form_data')
+    if isinstance(form_data, str):
+        try:
+            form_data = json.loads(form_data)
+        except json.JSONDecodeError as e:
+            return None, f"form_data is not valid JSON: {e.msg}"
+    if not isinstance(form_data, dict):
+        return None, "form_data must be a JSON object"
+
+    status = _clean(record, 'current_status') or 'pending'
+    if status not in FORM_STATUSES:
+        return None, f"Unknown status: {status}"
+    try:
+        step = int(record.get('current_step') or 1)
+    except (TypeError, ValueError):
+        return None, f"current_step is not a number: {record.get('current_step')}"
+    if not 1 <= step <= LAST_STEP:
+        return None, f"current_step must be between 1 and {LAST_STEP}"
+
+    created_at = _clean(record, 'created_at') or None
+    if created_at:
+        try:
+            created_at = datetime.fromisoformat(created_at).isoformat(' ')
+        except ValueError:
+            return None, f"Invalid created_at: {created_at}"
+
+    return (title, record.get('description') or '', json.dumps(form_data),
+            _clean(record, 'created_by') or None, status, step,
+            created_at), None
+
+
+def _user_ids(db, usernames):
+    placeholders = ', '.join(['%s'] * len(usernames))
+    rows = db.fetch_all(
+        f"SELECT username, id FROM users WHERE username IN ({placeholders})",
+        tuple(usernames), name='import_forms_users')
+    return dict(rows)
+
+
+def load_checkpoint(db, source):
+    """Last line committed by an import of source, or 0"""
+    row = db.fetch_one(
+        "SELECT line_number FROM import_checkpoints WHERE source = %s",
+        (source, ), name='import_checkpoint')
+    return row[0] if row else 0
+
+
+def reset_checkpoint(db, source):
+    with db.unit_of_work('import_checkpoint_reset') as uow:
+        uow.execute("DELETE FROM import_checkpoints WHERE source = %s",
+                    (source, ))
+
+
+class CheckpointMoved(Exception):
+    """Another import of the same source committed in the meantime"""
+
+
+def _insert_forms(db, user, rows, source, after_line, last_line, imported):
+    """Insert a batch covering lines after_line+1..last_line
+
+    The checkpoint must still be at after_line, where this run left it.
+    """
+    with db.unit_of_work('import_forms') as uow:
+        uow.execute(
+            "SELECT line_number FROM import_checkpoints WHERE source = %s",
+            (source, ))
+        checkpoint = uow.fetchone()
+        checkpoint = checkpoint[0] if checkpoint else 0
+        if checkpoint == last_line:
+            # Committed by an earlier attempt whose acknowledgement was lost
+            return
+        if checkpoint != after_line:
+            raise CheckpointMoved(
+                f"Checkpoint for {source} is at line {checkpoint}, expected "
+                f"{after_line}; is another import of it running?")
+        # Legacy forms keep their original date as the last change too
+        uow.executemany(
+            """
+            INSERT INTO forms (title, description, form_data, created_by,
+                               current_status, current_step, created_at,
+                               updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP),
+                    COALESCE(%s, CURRENT_TIMESTAMP))
+        """, rows)
+        uow.execute(
+            """
+            UPDATE import_checkpoints
+            SET line_number = %s, imported = imported + %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE source = %s
+        """, (last_line, imported, source))
+        if uow.rowcount == 0:
+            uow.execute(
+                """
+                INSERT INTO import_checkpoints (source, line_number, imported)
+                VALUES (%s, %s, %s)
+            """, (source, last_line, imported))
+        db.log_action(user['id'], "Imported forms",
+                      f"{imported} forms from {source} up to line {last_line}",
+                      cursor=uow)
+
+
+def import_forms(db, user, path, batch_size=FORM_BATCH_SIZE, resume=False,
+                 source=None, progress=None):
+    """Create the forms listed in path, one transaction per batch
+
+    Columns are title, form_data and optionally description, created_by
+    (a username, defaulting to user), current_status, current_step and
+    created_at. Each batch commits its forms, a checkpoint and one audit
+    entry together; with resume, lines up to the checkpoint are skipped.
+    Without resume, the checkpoint of source (by default the absolute
+    path) is reset and the whole file is imported.
+    """
+    source = source or os.path.abspath(path)
+    if resume:
+        start_after = load_checkpoint(db, source)
+    else:
+        start_after = 0
+        db.run(reset_checkpoint, db, source)
+    committed_line = start_after
+    report = ImportReport(path)
+    user_ids = {user['username']: user['id']}
+
+    for batch in chunked(read_records(path), batch_size):
+        valid = []
+        for line_number, record, error in batch:
+            if line_number <= start_after:
+                report.skipped += 1
+                continue
+            report.rows += 1
+            if error is None:
+                row, error = validate_form(record)
+            if error is not None:
+                report.error(line_number, error)
+                continue
+            valid.append((line_number, row))
+
+        unknown = {row[3] for _, row in valid
+                   if row[3] and row[3] not in user_ids}
+        if unknown:
+            user_ids.update(_user_ids(db, sorted(unknown)))
+
+        rows = []
+        for line_number, row in valid:
+            title, description, form_data, creator, status, step, created_at = row
+            creator_id = user_ids.get(creator or user['username'])
+            if creator_id is None:
+                report.error(line_number, f"Unknown user: {creator}")
+                continue
+            rows.append((title, description, form_data, creator_id, status,
+                         step, created_at, created_at))
+
+        last_line = batch[-1][0]
+        if rows and last_line > start_after:
+            try:
+                db.run(_insert_forms, db, user, rows, source, committed_line,
+                       last_line, len(rows), idempotent=True)
+                report.imported += len(rows)
+                committed_line = last_line
+            except Exception as e:
+                # Stop so the checkpoint stays at the last committed batch
+                report.error(batch[0][0],
+                             f"Batch failed, import stopped: {describe_error(e)}")
+                break
+
+        if progress:
+            progress(report)
+    return report
+
+
+def _find_user(db, username):
+    row = db.fetch_one(
+        "SELECT id, username, role FROM users WHERE username = %s",
+        (username, ))
+    if row is None:
+        raise SystemExit(f"No such user: {username}")
+    return {'id': row[0], 'username': row[1], 'role': row[2]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='kind', required=True)
+
+    users_parser = subparsers.add_parser(
+        'users', help="create users from username,password,role,email rows")
+    users_parser.add_argument('path', help=".csv or .jsonl file")
+    users_parser.add_argument('--chunk-size', type=int, default=USER_CHUNK_SIZE)
+
+    forms_parser = subparsers.add_parser(
+        'forms', help="create forms from title,description,form_data,... rows")
+    forms_parser.add_argument('path', help=".csv or .jsonl file")
+    forms_parser.add_argument('--batch-size', type=int, default=FORM_BATCH_SIZE)
+    forms_parser.add_argument('--resume', action='store_true',
+                              help="skip rows committed by an earlier run")
+    forms_parser.add_argument('--source',
+                              help="checkpoint name, defaults to the absolute "
+                              "path of the file")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('--database-url', required=True)
+        subparser.add_argument('--as-user', default='admin',
+                               help="user the audit log entries are written as")
+        subparser.add_argument('--errors',
+                               help="write rejected rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    db = DatabaseManager(args.database_url)
+    if not db.is_connected():
+        print(f"Could not connect to {args.database_url}")
+        return 1
+    def progress(report):
+        print(f"{report.rows} rows read, {report.imported} imported, "
+              f"{report.rate():.0f} rows/s")
+
+    try:
+        user = _find_user(db, args.as_user)
+        if args.kind == 'users':
+            report = import_users(db, user, args.path, args.chunk_size,
+                                  progress=progress)
+        else:
+            report = import_forms(db, user, args.path, args.batch_size,
+                                  args.resume, args.source, progress=progress)
+        print(report.summary())
+        if args.errors and report.errors:
+            report.write_errors(args.errors)
+            print(f"Rejected rows written to {args.errors}")
+    finally:
+        db.close()
+    return 0 if not report.errors else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Write-behind journal for approvals and form submissions.
+
+A write is appended to a local JSON-lines file and fsync'd before the UI
+moves on; a background sender then replays it against the database with
+exponential backoff. Every entry carries an idempotency key that the
+server stores in a UNIQUE request_key column, so a replay after a lost
+acknowledgement is recognised instead of applied twice.
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from resilience import CircuitOpen, classify
+from workflow import WorkflowError
+
+JOURNAL_FILE = 'journal.jsonl'
+
+PENDING = 'pending'
+SYNCED = 'synced'
+CONFLICT = 'conflict'
+
+
+class Journal:
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._load()
+        self._compact()
+        # Held open for appends until close()
+        self._file = open(self.path, 'a', encoding='utf-8')  # noqa: SIM115
+
+    @classmethod
+    def beside(cls, config_file):
+        directory = os.path.dirname(os.path.abspath(config_file))
+        return cls(os.path.join(directory, JOURNAL_FILE))
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from a crash mid-append
+                continue
+            if 'op' in record:
+                self.entries[record['key']] = record
+            elif record['key'] in self.entries:
+                self.entries[record['key']].update(record)
+
+    def _compact(self):
+        # Settled entries from earlier sessions aren't needed any more
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if entry['status'] == PENDING
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, default=str) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def add(self, op, user, args, label):
+        """Durably record a write and return its idempotency key"""
+        key = uuid.uuid4().hex
+        entry = {
+            'key': key,
+            'op': op,
+            'user': {name: user[name] for name in ('id', 'username', 'role')},
+            'args': args,
+            'label': label,
+            'status': PENDING,
+            'detail': '',
+            'created_at': datetime.now().isoformat(' ', 'seconds')
+        }
+        with self._lock:
+            self._append(entry)
+            self.entries[key] = entry
+        self._notify()
+        return key
+
+    def settle(self, key, status, detail=''):
+        with self._lock:
+            self._append({'key': key, 'status': status, 'detail': detail})
+            self.entries[key].update(status=status, detail=detail)
+        self._notify()
+
+    def note_error(self, key, detail):
+        """Remember why the last attempt failed, without changing the status"""
+        with self._lock:
+            self.entries[key]['detail'] = detail
+
+    def pending(self):
+        with self._lock:
+            return [
+                dict(entry) for entry in self.entries.values()
+                if entry['status'] == PENDING
+            ]
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(entry) for entry in self.entries.values()]
+
+    def counts(self):
+        counts = {PENDING: 0, SYNCED: 0, CONFLICT: 0}
+        with self._lock:
+            for entry in self.entries.values():
+                counts[entry['status']] += 1
+        return counts
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class JournalSender:
+    """Replays pending journal entries in order on a background thread"""
+
+    def __init__(self, journal, get_workflow, base_delay=1.0, max_delay=60.0):
+        self.journal = journal
+        self.get_workflow = get_workflow
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="journal-sender",
+                                        daemon=True)
+        journal.add_listener(self._wake.set)
+
+    def start(self):
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.delay or None)
+            self._wake.clear()
+            if self._stopped:
+                return
+            for entry in self.journal.pending():
+                if not self._send(entry):
+                    # Back off and retry from the same entry to keep order
+                    self.delay = min(self.max_delay,
+                                     max(self.base_delay, self.delay * 2))
+                    break
+            else:
+                self.delay = 0.0
+
+    def _send(self, entry):
+        workflow = self.get_workflow()
+        args = entry['args']
+        try:
+            if entry['op'] == 'decide':
+                handled = workflow.decide(entry['user'],
+                                          args['form_id'],
+                                          args['action'],
+                                          args['comments'],
+                                          request_key=entry['key'])
+                if handled:
+                    self.journal.settle(entry['key'], SYNCED)
+                else:
+                    self.journal.settle(
+                        entry['key'], CONFLICT,
+                        "Already handled by another user")
+            elif entry['op'] == 'submit_form':
+                form_id = workflow.submit_form(entry['user'],
+                                               args['title'],
+                                               args['description'],
+                                               args['form_data'],
+                                               request_key=entry['key'])
+                self.journal.settle(entry['key'], SYNCED, f"Form {form_id}")
+            else:
+                self.journal.settle(entry['key'], CONFLICT,
+                                    f"Unknown operation {entry['op']}")
+        except WorkflowError as e:
+            self.journal.settle(entry['key'], CONFLICT, str(e))
+        except Exception as e:
+            if (isinstance(e, CircuitOpen) or classify(e) is not None
+                    or not workflow.db.is_connected()):
+                # The database is unreachable or busy; keep it pending
+                self.journal.note_error(entry['key'], str(e))
+                return False
+            # Rejected by the database; retrying would only block the queue
+            self.journal.settle(entry['key'], CONFLICT, str(e))
+        return True
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
@@ -0,0 +1,189 @@
+"""On-disk cache of the signed-in user's data.
+
+The dashboard paints from this SQLite file first and then reconciles with
+the central database in the background. When the central database can't be
+reached the client falls back to it for a read-only view. Rows are stored
+with their updated_at version so a reconcile only rewrites what changed.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import bcrypt
+
+LOCAL_STORE_FILE = 'local_cache.db'
+# Offline logins only need to resist a stolen cache file, not be slow
+OFFLINE_HASH_ROUNDS = 10
+
+
+def _encode(value):
+    return json.dumps(value, default=str)
+
+
+def _version(value):
+    return None if value is None else str(value)
+
+
+class LocalStore:
+
+    def __init__(self, path=LOCAL_STORE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    user_json TEXT NOT NULL,
+                    password_hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS rows (
+                    kind TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    row_id INTEGER NOT NULL,
+                    version TEXT,
+                    row_json TEXT NOT NULL,
+                    PRIMARY KEY (kind, user_id, row_id)
+                );
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    kind TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    saved_at TEXT NOT NULL,
+                    PRIMARY KEY (kind, user_id)
+                );
+                CREATE TABLE IF NOT EXISTS form_details (
+                    form_id INTEGER PRIMARY KEY,
+                    version TEXT,
+                    form_json TEXT NOT NULL,
+                    approvals_json TEXT NOT NULL
+                );
+            """)
+
+    @classmethod
+    def beside(cls, config_file):
+        """Open the store in the same directory as config_file"""
+        directory = os.path.dirname(os.path.abspath(config_file))
+        return cls(os.path.join(directory, LOCAL_STORE_FILE))
+
+    def has_users(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM users").fetchone()[0] > 0
+
+    def remember_user(self, user, password):
+        password_hash = bcrypt.hashpw(
+            password.encode('utf-8'),
+            bcrypt.gensalt(rounds=OFFLINE_HASH_ROUNDS)).decode('utf-8')
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                (user['username'], _encode(user), password_hash))
+
+    def offline_login(self, username, password):
+        """The user as last seen online, if the password matches"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_json, password_hash FROM users WHERE username = ?",
+                (username, )).fetchone()
+        if row and bcrypt.checkpw(password.encode('utf-8'),
+                                  row[1].encode('utf-8')):
+            user = json.loads(row[0])
+            user['offline'] = True
+            return user
+        return None
+
+    def _stored_versions(self, kind, user_id):
+        return dict(
+            self._conn.execute(
+                "SELECT row_id, version FROM rows WHERE kind = ? AND user_id = ?",
+                (kind, user_id)))
+
+    def _write_rows(self, kind, user_id, rows, stored, version_index):
+        changed = [(kind, user_id, row[0], _version(row[version_index]),
+                    _encode(list(row)))
+                   for row in rows
+                   if row[0] not in stored
+                   or stored[row[0]] != _version(row[version_index])]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)", changed)
+
+    def _finish_save(self, kind, user_id, stored, current_ids):
+        gone = [(kind, user_id, row_id) for row_id in stored
+                if row_id not in current_ids]
+        self._conn.executemany(
+            "DELETE FROM rows WHERE kind = ? AND user_id = ? AND row_id = ?",
+            gone)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+            (kind, user_id, datetime.now().isoformat(' ', 'seconds')))
+
+    def save_rows(self, kind, user_id, rows, version_index):
+        """Make the stored rows of kind match rows, keyed by row[0]"""
+        with self._lock, self._conn:
+            stored = self._stored_versions(kind, user_id)
+            current = {row[0]: row for row in rows}
+            self._write_rows(kind, user_id, current.values(), stored,
+                             version_index)
+            self._finish_save(kind, user_id, stored, current)
+
+    def save_rows_from(self, kind, user_id, batches, version_index):
+        """Yield batches of rows, saving each one as it goes by
+
+        Like save_rows without holding the whole list: only the ids seen
+        are kept. Rows that are gone are only deleted, and the snapshot
+        only dated, once every batch has been seen.
+        """
+        with self._lock:
+            stored = self._stored_versions(kind, user_id)
+        seen = set()
+        try:
+            for rows in batches:
+                with self._lock, self._conn:
+                    self._write_rows(kind, user_id, rows, stored,
+                                     version_index)
+                seen.update(row[0] for row in rows)
+                yield rows
+            with self._lock, self._conn:
+                self._finish_save(kind, user_id, stored, seen)
+        finally:
+            close = getattr(batches, 'close', None)
+            if close:
+                close()
+
+    def load_rows(self, kind, user_id):
+        """Return (rows, saved_at) from the last save, or ([], None)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_json FROM rows WHERE kind = ? AND user_id = ? "
+                "ORDER BY row_id",
+                (kind, user_id)).fetchall()
+            saved = self._conn.execute(
+                "SELECT saved_at FROM snapshots WHERE kind = ? AND user_id = ?",
+                (kind, user_id)).fetchone()
+        return ([tuple(json.loads(row[0])) for row in rows],
+                saved[0] if saved else None)
+
+    def save_detail(self, form_id, version, form, approvals):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO form_details VALUES (?, ?, ?, ?)",
+                (form_id, _version(version), _encode(list(form)),
+                 _encode([list(approval) for approval in approvals])))
+
+    def load_detail(self, form_id, version=None):
+        """(form, approvals) if stored at version, or at any version if None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, form_json, approvals_json FROM form_details "
+                "WHERE form_id = ?",
+                (form_id, )).fetchone()
+        if row is None or (version is not None and row[0] != _version(version)):
+            return None
+        return (tuple(json.loads(row[1])),
+                [tuple(approval) for approval in json.loads(row[2])])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
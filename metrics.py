@@ -0,0 +1,231 @@
+"""Per-query timing for DatabaseManager.
+
+Connections handed out by DatabaseManager are wrapped so every statement
+records its pool checkout wait, execute time, fetch time and row count under
+a logical query name such as 'inbox' or 'audit_page'. Statements slower than
+a threshold are also written to a slow-query log file.
+"""
+import logging
+import os
+import threading
+import time
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log')
+
+# Upper bounds of the histogram buckets; the last bucket is open ended
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+slow_log = logging.getLogger('forms.slow_query')
+
+
+def configure_slow_log(path=SLOW_QUERY_LOG):
+    """Send slow-query records to path, once per process"""
+    if slow_log.handlers:
+        return
+    handler = logging.FileHandler(path, delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.INFO)
+    slow_log.propagate = False
+
+
+class Histogram:
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        if not self.count:
+            return None
+        target = pct / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': list(zip(self.bounds + ('inf', ), self.counts,
+                                strict=True))
+        }
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.checkout_ms = Histogram(MS_BUCKETS)
+        self.execute_ms = Histogram(MS_BUCKETS)
+        self.fetch_ms = Histogram(MS_BUCKETS)
+        self.rows = Histogram(ROW_BUCKETS)
+
+
+class QueryMetrics:
+    """Thread-safe histograms of statement timings keyed by query name"""
+
+    def __init__(self, slow_threshold_ms=SLOW_QUERY_MS, slow_log_path=SLOW_QUERY_LOG):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_queries = 0
+        self._stats = {}
+        self._lock = threading.Lock()
+        if slow_log_path:
+            configure_slow_log(slow_log_path)
+
+    def _get(self, name):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = QueryStats()
+        return stats
+
+    def record_checkout(self, name, seconds):
+        with self._lock:
+            self._get(name).checkout_ms.add(seconds * 1000)
+
+    def record_statement(self, name, query, execute_seconds, fetch_seconds, rows):
+        execute_ms = execute_seconds * 1000
+        fetch_ms = fetch_seconds * 1000
+        with self._lock:
+            stats = self._get(name)
+            stats.execute_ms.add(execute_ms)
+            stats.fetch_ms.add(fetch_ms)
+            stats.rows.add(rows)
+            slow = execute_ms + fetch_ms >= self.slow_threshold_ms
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            slow_log.info("%s execute=%.1fms fetch=%.1fms rows=%d %s", name,
+                          execute_ms, fetch_ms, rows, ' '.join(query.split()))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'checkout_ms': stats.checkout_ms.snapshot(),
+                    'execute_ms': stats.execute_ms.snapshot(),
+                    'fetch_ms': stats.fetch_ms.snapshot(),
+                    'rows': stats.rows.snapshot()
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries = 0
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times each statement and the fetches that follow"""
+
+    def __init__(self, cursor, metrics, name):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._name = name
+        self._query = None
+        self._execute_seconds = 0.0
+        self._fetch_seconds = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        # A statement's fetch time is known once the next one starts
+        if self._query is not None:
+            self._metrics.record_statement(self._name, self._query,
+                                           self._execute_seconds,
+                                           self._fetch_seconds, self._rows)
+            self._query = None
+
+    def _run(self, method, query, params):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(query, params)
+        finally:
+            self._query = query
+            self._execute_seconds = time.perf_counter() - started
+            self._fetch_seconds = 0.0
+            self._rows = 0
+
+    def execute(self, query, params=()):
+        return self._run(self._cursor.execute, query, params)
+
+    def executemany(self, query, seq_params):
+        return self._run(self._cursor.executemany, query, seq_params)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        self._fetch_seconds += time.perf_counter() - started
+        if isinstance(result, list):
+            self._rows += len(result)
+        elif result is not None:
+            self._rows += 1
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+
+class InstrumentedConnection:
+
+    def __init__(self, conn, metrics, name, replica=None):
+        self._conn = conn
+        self._metrics = metrics
+        self.name = name
+        self.replica = replica
+
+    def cursor(self, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(**kwargs), self._metrics,
+                                  self.name)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    def discard(self):
+        self._conn.discard()
@@ -0,0 +1,232 @@
+"""Versioned schema migrations for the form approval database.
+
+Each migration is applied at most once and recorded in `schema_version`.
+Migrations must be idempotent so that a partially applied upgrade (MySQL
+commits DDL implicitly) can simply be re-run on the next connect. They
+receive the storage backend so that DDL can use its dialect.
+"""
+
+
+def create_index_if_missing(backend, cur, table, index_name, columns,
+                            unique=False):
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if backend.name == 'sqlite':
+        # No migration lock on SQLite, so let the engine do the check
+        cur.execute(
+            f"CREATE {kind} IF NOT EXISTS {index_name} ON {table} ({columns})")
+    elif not backend.index_exists(cur, table, index_name):
+        cur.execute(f"CREATE {kind} {index_name} ON {table} ({columns})")
+
+
+def add_column_if_missing(backend, cur, table, column, definition):
+    if not backend.column_exists(cur, table, column):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def create_base_tables(backend, cur):
+    types = backend.types
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id {types['pk']},
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            email VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    """)
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS forms (
+            id {types['pk']},
+            title VARCHAR(255) NOT NULL,
+            description TEXT,
+            form_data {types['json']} NOT NULL,
+            created_by INT NOT NULL,
+            current_status VARCHAR(50) DEFAULT 'pending',
+            current_step INT DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at {types['updated_at']},
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS approvals (
+            id {types['pk']},
+            form_id INT NOT NULL,
+            user_id INT NOT NULL,
+            step_number INT NOT NULL,
+            action VARCHAR(50) NOT NULL,
+            comments TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (form_id) REFERENCES forms(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id {types['pk']},
+            user_id INT,
+            action VARCHAR(255) NOT NULL,
+            details TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+
+
+def normalize_forms_updated_at(backend, cur):
+    # Tables created by the old in-app DDL had no default for updated_at
+    cur.execute(
+        "UPDATE forms SET updated_at = created_at WHERE updated_at IS NULL")
+    # SQLite tables have only ever been created with the default
+    if backend.name == 'mysql':
+        cur.execute("ALTER TABLE forms MODIFY updated_at "
+                    f"{backend.types['updated_at']}")
+
+
+def add_workflow_indexes(backend, cur):
+    # Pending approvals inbox
+    create_index_if_missing(backend, cur, 'forms', 'idx_forms_step_status',
+                            'current_step, current_status')
+    # My Forms
+    create_index_if_missing(backend, cur, 'forms', 'idx_forms_created_by_updated',
+                            'created_by, updated_at')
+    # Approval history of a form
+    create_index_if_missing(backend, cur, 'approvals', 'idx_approvals_form_timestamp',
+                            'form_id, timestamp')
+    # Audit log, paginated on (timestamp, id)
+    create_index_if_missing(backend, cur, 'audit_log', 'idx_audit_log_timestamp_id',
+                            'timestamp, id')
+
+
+def add_form_claims(backend, cur):
+    # Lease-based claims let approvers sharing a role work separate slices
+    add_column_if_missing(backend, cur, 'forms', 'claimed_by', 'INT NULL')
+    add_column_if_missing(backend, cur, 'forms', 'claim_expires_at',
+                          'TIMESTAMP NULL')
+    create_index_if_missing(backend, cur, 'forms', 'idx_forms_claimed_by',
+                            'claimed_by, claim_expires_at')
+
+
+def add_request_keys(backend, cur):
+    # Idempotency keys from the client journal; NULL for direct writes
+    for table in ('forms', 'approvals'):
+        add_column_if_missing(backend, cur, table, 'request_key',
+                              'VARCHAR(64) NULL')
+        create_index_if_missing(backend, cur, table,
+                                f"uq_{table}_request_key", 'request_key',
+                                unique=True)
+
+
+def add_import_checkpoints(_backend, cur):
+    # Committed with each import batch, so a resumed import neither skips
+    # nor repeats rows
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source VARCHAR(255) PRIMARY KEY,
+            line_number INT NOT NULL,
+            imported INT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def add_export_indexes(backend, cur):
+    # Time-range exports walk these in (time, id) order
+    create_index_if_missing(backend, cur, 'approvals', 'idx_approvals_timestamp_id',
+                            'timestamp, id')
+    create_index_if_missing(backend, cur, 'forms', 'idx_forms_updated_id',
+                            'updated_at, id')
+
+
+# Columns the two copies of the old in-app DDL left nullable
+LEGACY_REQUIRED_COLUMNS = [
+    ('forms', 'created_by', 'INT NOT NULL'),
+    ('forms', 'form_data', 'JSON NOT NULL'),
+    ('approvals', 'form_id', 'INT NOT NULL'),
+    ('approvals', 'user_id', 'INT NOT NULL'),
+]
+
+# Columns the old DDL declared narrower or stricter than create_base_tables
+LEGACY_RELAXED_COLUMNS = [
+    ('forms', 'title', 'VARCHAR(255) NOT NULL'),
+    ('audit_log', 'action', 'VARCHAR(255) NOT NULL'),
+    # NULL for actions with no signed-in user
+    ('audit_log', 'user_id', 'INT NULL'),
+]
+
+
+def align_legacy_columns(backend, cur):
+    # SQLite tables have only ever been created by create_base_tables
+    if backend.name != 'mysql':
+        return
+    for table, column, definition in LEGACY_RELAXED_COLUMNS:
+        cur.execute(f"ALTER TABLE {table} MODIFY {column} {definition}")
+    for table, column, definition in LEGACY_REQUIRED_COLUMNS:
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} IS NULL")
+        missing = cur.fetchone()[0]
+        if missing:
+            # Guessing an owner would be worse than leaving the column as is
+            print(f"Left {table}.{column} nullable: {missing} row(s) have no "
+                  f"value. Fill them in and run: ALTER TABLE {table} "
+                  f"MODIFY {column} {definition}")
+            continue
+        cur.execute(f"ALTER TABLE {table} MODIFY {column} {definition}")
+
+
+MIGRATIONS = [
+    (1, "Create base tables", create_base_tables),
+    (2, "Default forms.updated_at to the current time",
+     normalize_forms_updated_at),
+    (3, "Index inbox, my forms, approval history and audit log",
+     add_workflow_indexes),
+    (4, "Add claim lease columns to forms", add_form_claims),
+    (5, "Add idempotency keys to forms and approvals", add_request_keys),
+    (6, "Add import checkpoints", add_import_checkpoints),
+    (7, "Index approvals and forms by time for exports", add_export_indexes),
+    (8, "Align columns created by the old in-app DDL", align_legacy_columns),
+]
+
+
+def run_migrations(backend, conn):
+    """Apply all pending migrations on conn, returning the schema version"""
+    cur = conn.cursor()
+    try:
+        # Serialise clients that connect at the same time
+        backend.acquire_lock(cur, 'schema_migrations')
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current_version = cur.fetchone()[0]
+
+            for version, description, migrate in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                migrate(backend, cur)
+                cur.execute(
+                    f"""
+                    {backend.insert_ignore} INTO schema_version (version, description)
+                    VALUES (%s, %s)
+                """, (version, description))
+                conn.commit()
+                current_version = version
+
+            return current_version
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            backend.release_lock(cur, 'schema_migrations')
+    finally:
+        cur.close()
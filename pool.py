@@ -0,0 +1,242 @@
+"""Connection pool shared by the storage backends.
+
+Checkout blocks (up to a timeout) when every connection is busy instead of
+failing, the pool grows on demand between a minimum and maximum size, and
+connections are warmed up in the background, validated after sitting idle
+and retired once they are too old.
+"""
+import contextlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# How a connection is cleaned up when it comes back to the pool
+RESET_STRATEGIES = ('none', 'rollback', 'session')
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the checkout timeout"""
+
+
+class _Slot:
+    """A raw connection with the timestamps the pool needs"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PooledConnection:
+    """Connection handed to callers; close() gives it back to the pool"""
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+
+    def cursor(self, **kwargs):
+        return self._slot.conn.cursor(**kwargs)
+
+    def commit(self):
+        self._slot.conn.commit()
+
+    def rollback(self):
+        self._slot.conn.rollback()
+
+    def close(self):
+        if self._slot is not None:
+            slot, self._slot = self._slot, None
+            self._pool._release(slot)
+
+    def discard(self):
+        """Close the raw connection instead of giving it back for reuse"""
+        if self._slot is not None:
+            slot, self._slot = self._slot, None
+            self._pool._retire(slot)
+
+
+class ConnectionPool:
+
+    def __init__(self,
+                 connect,
+                 max_size=10,
+                 min_size=2,
+                 timeout=30,
+                 reset='rollback',
+                 ping=None,
+                 reset_session=None,
+                 validate_after=30,
+                 max_idle=600,
+                 max_lifetime=1800,
+                 pool_name='pool'):
+        if reset not in RESET_STRATEGIES:
+            raise ValueError(f"Unknown pool reset strategy: {reset}")
+        self._connect = connect
+        self._ping = ping
+        self._reset_session = reset_session
+        self.pool_name = pool_name
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.timeout = timeout
+        self.reset = reset
+        self.validate_after = validate_after
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {
+            'created': 0,
+            'retired': 0,
+            'failed_validations': 0,
+            'waits': 0,
+            'timeouts': 0
+        }
+
+    def warm_up(self):
+        """Open connections up to min_size in parallel on a background thread"""
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        if not missing:
+            return
+
+        def open_one():
+            try:
+                slot = _Slot(self._connect())
+            except Exception as e:
+                print(f"Pool warm-up connection failed: {e}")
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                return
+            with self._cond:
+                self.stats['created'] += 1
+                closed = self._closed
+                if not closed:
+                    self._idle.append(slot)
+                    self._cond.notify()
+            # The pool was closed while this connection was opening
+            if closed:
+                self._retire(slot)
+
+        def run():
+            with ThreadPoolExecutor(max_workers=missing,
+                                    thread_name_prefix="pool-warmup") as workers:
+                for _ in range(missing):
+                    workers.submit(open_one)
+
+        threading.Thread(target=run, name="pool-warmup", daemon=True).start()
+
+    def get_connection(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            slot = None
+            with self._cond:
+                waited = False
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    if self._idle:
+                        # Most recently used first, so spare connections
+                        # age at the other end and can be retired
+                        slot = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No connection free in pool {self.pool_name} "
+                            f"after {timeout}s")
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+
+            if slot is None:
+                try:
+                    slot = _Slot(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self.stats['created'] += 1
+                return PooledConnection(self, slot)
+
+            if self._usable(slot):
+                return PooledConnection(self, slot)
+            self._retire(slot)
+
+    def _usable(self, slot):
+        now = time.monotonic()
+        if now - slot.created_at > self.max_lifetime:
+            return False
+        if self._ping and now - slot.last_used > self.validate_after:
+            try:
+                self._ping(slot.conn)
+            except Exception:
+                with self._cond:
+                    self.stats['failed_validations'] += 1
+                return False
+        return True
+
+    def _release(self, slot):
+        try:
+            if self.reset == 'rollback':
+                slot.conn.rollback()
+            elif self.reset == 'session' and self._reset_session:
+                self._reset_session(slot.conn)
+        except Exception:
+            # A connection that can't be cleaned up can't be reused
+            self._retire(slot)
+            return
+
+        slot.last_used = time.monotonic()
+        expired = []
+        with self._cond:
+            if self._closed or slot.last_used - slot.created_at > self.max_lifetime:
+                expired.append(slot)
+            else:
+                self._idle.append(slot)
+            # Shrink back towards min_size once spare connections go unused
+            while (self._idle and self._size - len(expired) > self.min_size
+                   and slot.last_used - self._idle[0].last_used > self.max_idle):
+                expired.append(self._idle.popleft())
+            self._cond.notify()
+        for stale in expired:
+            self._retire(stale)
+
+    def _retire(self, slot):
+        with contextlib.suppress(Exception):
+            slot.conn.close()
+        with self._cond:
+            self._size -= 1
+            self.stats['retired'] += 1
+            self._cond.notify()
+
+    def status(self):
+        with self._cond:
+            status = dict(self.stats)
+            status.update(size=self._size,
+                          idle=len(self._idle),
+                          min_size=self.min_size,
+                          max_size=self.max_size,
+                          reset=self.reset)
+            return status
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for slot in idle:
+            self._retire(slot)
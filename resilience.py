@@ -0,0 +1,202 @@
+"""Retry policy and circuit breakers for transient database errors.
+
+Errors are classified by MySQL error number (or the SQLite equivalent).
+Transient ones are retried with jittered exponential backoff. Each endpoint
+has a circuit breaker so that once it keeps failing, callers fail fast
+instead of all waiting on timeouts. Everything is counted so it shows up
+in the Diagnostics panel.
+"""
+import random
+import sqlite3
+import threading
+import time
+
+from pool import PoolTimeout
+
+DEADLOCK = 'deadlock'
+LOCK_WAIT = 'lock_wait'
+LOST_CONNECTION = 'lost_connection'
+UNREACHABLE = 'unreachable'
+POOL_EXHAUSTED = 'pool_exhausted'
+
+# MySQL client and server error numbers
+ERRNO_CLASSES = {
+    1213: DEADLOCK,  # ER_LOCK_DEADLOCK
+    1205: LOCK_WAIT,  # ER_LOCK_WAIT_TIMEOUT
+    2006: LOST_CONNECTION,  # CR_SERVER_GONE_ERROR
+    2013: LOST_CONNECTION,  # CR_SERVER_LOST
+    2055: LOST_CONNECTION,  # CR_SERVER_LOST_EXTENDED
+    2003: UNREACHABLE,  # CR_CONN_HOST_ERROR
+    2005: UNREACHABLE,  # CR_UNKNOWN_HOST
+}
+
+# Classes that say the endpoint itself is unhealthy. A busy pool says only
+# that this process is busy, so it must not open the breaker.
+ENDPOINT_FAILURES = {LOST_CONNECTION, UNREACHABLE}
+
+MESSAGES = {
+    DEADLOCK: "The database was busy with a conflicting change. Please try again.",
+    LOCK_WAIT: "The database was busy with a conflicting change. Please try again.",
+    LOST_CONNECTION: "The connection to the database was lost. Please try again.",
+    UNREACHABLE: ("The database server can't be reached. "
+                  "Check the network and try again."),
+    POOL_EXHAUSTED: "All database connections are busy. Please try again shortly.",
+}
+
+
+class CircuitOpen(Exception):
+    """An endpoint's breaker is open, so the call was not attempted"""
+
+    def __init__(self, endpoint, retry_in):
+        super().__init__(
+            f"{endpoint} is unavailable, retrying in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def classify(error):
+    """Name the transient error class of error, or None if it isn't transient"""
+    if isinstance(error, PoolTimeout):
+        return POOL_EXHAUSTED
+    if isinstance(error, sqlite3.OperationalError):
+        return LOCK_WAIT if 'locked' in str(error) else None
+    errno = getattr(error, 'errno', None)
+    if errno in ERRNO_CLASSES:
+        return ERRNO_CLASSES[errno]
+    # Socket errors from the pure Python connector before it has an errno
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return LOST_CONNECTION
+    return None
+
+
+def commit_outcome_unknown(error):
+    """True if error came from a commit that may or may not have applied"""
+    return getattr(error, 'commit_outcome_unknown', False)
+
+
+def describe_error(error):
+    """A message for the user instead of the raw driver exception"""
+    if commit_outcome_unknown(error):
+        return ("The connection was lost while saving, so the change may "
+                "or may not have been applied. Please check before retrying.")
+    if isinstance(error, CircuitOpen):
+        return f"The database is unavailable. Trying again in {error.retry_in:.0f}s."
+    return MESSAGES.get(classify(error), str(error))
+
+
+class ResilienceStats:
+
+    def __init__(self):
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class CircuitBreaker:
+    """Closed until failure_threshold consecutive failures, then open for
+    reset_timeout seconds, then half-open for a single trial call"""
+
+    def __init__(self, endpoint, stats, failure_threshold=5, reset_timeout=30):
+        self.endpoint = endpoint
+        self.stats = stats
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go to the endpoint now"""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == 'open' and waited >= self.reset_timeout:
+                self.state = 'half_open'
+                return
+            self.stats.count('short_circuited')
+            raise CircuitOpen(self.endpoint, max(0, self.reset_timeout - waited))
+
+    def is_open(self):
+        with self._lock:
+            return (self.state == 'open' and
+                    time.monotonic() - self.opened_at < self.reset_timeout)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (
+                    self.state == 'closed'
+                    and self.failures >= self.failure_threshold):
+                if self.state != 'open':
+                    self.stats.count('breaker_opened')
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
+
+
+class RetryPolicy:
+
+    def __init__(self, stats, max_attempts=4, base_delay=0.05, max_delay=2.0):
+        self.stats = stats
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        # Full jitter keeps clients that failed together from retrying together
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2**attempt))
+
+    def run(self, breaker, func, *args, idempotent=False):
+        """Call func(*args), retrying transient errors and feeding breaker
+
+        A failed commit is only retried if func is idempotent, since the
+        server may have applied it before the connection was lost.
+        """
+        attempt = 0
+        while True:
+            breaker.allow()
+            try:
+                result = func(*args)
+            except Exception as e:
+                error_class = classify(e)
+                if error_class in ENDPOINT_FAILURES:
+                    breaker.record_failure()
+                elif error_class != POOL_EXHAUSTED:
+                    # The endpoint answered, even if with an error
+                    breaker.record_success()
+                if error_class is None:
+                    raise
+                self.stats.count(error_class)
+                if error_class == POOL_EXHAUSTED:
+                    # The checkout already waited its full timeout
+                    raise
+                if commit_outcome_unknown(e) and not idempotent:
+                    self.stats.count('commit_unknown')
+                    raise
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    self.stats.count('gave_up')
+                    raise
+                self.stats.count('retries')
+                time.sleep(self.backoff(attempt))
+                continue
+            breaker.record_success()
+            return result
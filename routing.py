@@ -0,0 +1,113 @@
+"""Read replica selection for DatabaseManager.
+
+Each replica gets its own pool. Reads go to the healthy replica with the
+lowest smoothed latency, with an occasional random pick so the estimates
+of the others stay fresh. A replica that fails is skipped for a cooldown
+period, and reads fall back to the primary when no replica is usable.
+"""
+import random
+import threading
+import urllib.parse
+
+from backends import create_backend
+from resilience import CircuitBreaker
+
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.2
+# Share of reads sent to a random healthy replica
+EXPLORE_RATE = 0.1
+# Seconds a failing replica's breaker stays open before it is tried again
+REPLICA_COOLDOWN_SECONDS = 30
+# A busy replica is passed over rather than waited on for long
+REPLICA_CHECKOUT_TIMEOUT = 1
+# Seconds after a client's own commit during which it reads from the primary
+READ_YOUR_WRITES_SECONDS = 5
+
+
+def describe_url(url):
+    """Endpoint label without credentials"""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return url
+    return f"{parsed.hostname}:{parsed.port or 3306}{parsed.path}"
+
+
+class Replica:
+
+    def __init__(self, url, stats):
+        self.url = url
+        self.label = describe_url(url)
+        self.backend = create_backend(url)
+        self.pool = None
+        self.latency_ms = None
+        self.breaker = CircuitBreaker(self.label,
+                                      stats,
+                                      failure_threshold=2,
+                                      reset_timeout=REPLICA_COOLDOWN_SECONDS)
+        self.reads = 0
+        self.failures = 0
+
+    def status(self):
+        return {
+            'endpoint': self.label,
+            'latency_ms': self.latency_ms,
+            'down': self.breaker.is_open(),
+            'breaker': self.breaker.status()['state'],
+            'reads': self.reads,
+            'failures': self.failures,
+            'pool': self.pool.status() if self.pool else None
+        }
+
+
+class ReplicaSet:
+
+    def __init__(self, urls, stats):
+        self.replicas = [Replica(url, stats) for url in urls]
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def open(self, max_size, min_size, timeout, reset):
+        for replica in self.replicas:
+            replica.pool = replica.backend.create_pool(max_size=max_size,
+                                                       min_size=min_size,
+                                                       timeout=timeout,
+                                                       reset=reset)
+            replica.pool.warm_up()
+
+    def candidates(self):
+        """Healthy replicas, best first"""
+        healthy = [r for r in self.replicas if not r.breaker.is_open()]
+        if not healthy:
+            return []
+        # Unmeasured replicas sort first so each gets sampled
+        healthy.sort(key=lambda r: -1 if r.latency_ms is None else r.latency_ms)
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            pick = random.randrange(1, len(healthy))
+            healthy.insert(0, healthy.pop(pick))
+        return healthy
+
+    def observe(self, replica, seconds):
+        with self._lock:
+            replica.reads += 1
+            sample = seconds * 1000
+            if replica.latency_ms is None:
+                replica.latency_ms = sample
+            else:
+                replica.latency_ms += LATENCY_SMOOTHING * (sample -
+                                                           replica.latency_ms)
+
+    def record_failure(self, replica, error):
+        print(f"Replica {replica.label} failed, using another endpoint: {error}")
+        with self._lock:
+            replica.failures += 1
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.pool:
+                replica.pool.close()
+                replica.pool = None
@@ -0,0 +1,231 @@
+"""Tk widgets shared by the application screens."""
+import queue
+import threading
+from tkinter import ttk
+
+from resilience import describe_error
+
+# Rows inserted per turn of the event loop; small enough to stay responsive
+CHUNK_SIZE = 500
+# How often a streaming load checks for the next batch
+STREAM_POLL_MS = 50
+# Batches a streaming job may get ahead of the screen
+STREAM_QUEUE_BATCHES = 8
+
+
+class DataGrid(ttk.Frame):
+    """A Treeview with a scrollbar and status line that fills in chunks
+
+    Rows are inserted a chunk at a time from after() callbacks, so a large
+    result never blocks the mainloop for long. Only the Treeview holds the
+    rows; `row_count` says how many it shows. A load is cancelled when a new
+    one starts, when cancel() is called, or when the grid is destroyed on
+    navigation.
+    """
+
+    def __init__(self, parent, columns, height=15, column_width=120,
+                 chunk_size=CHUNK_SIZE, on_scroll_end=None):
+        super().__init__(parent)
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.on_scroll_end = on_scroll_end
+        self.row_count = 0
+        self._replace = False
+        self._pending = []
+        self._pending_index = 0
+        self._batches = None
+        self._on_done = None
+        self._after_id = None
+        self._generation = 0
+        self._cancel = threading.Event()
+
+        self.status_label = ttk.Label(self, text="")
+        self.status_label.pack(side='bottom', anchor='w')
+
+        self.tree = ttk.Treeview(self,
+                                 columns=columns,
+                                 show='headings',
+                                 height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=column_width)
+
+        self.scrollbar = ttk.Scrollbar(self,
+                                       orient='vertical',
+                                       command=self.tree.yview)
+        self.scrollbar.pack(side='right', fill='y')
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(fill='both', expand=True)
+
+        self.bind('<Destroy>', self._on_destroy)
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def cancel(self):
+        """Stop inserting rows and tell a streaming job to stop fetching"""
+        self._generation += 1
+        self._cancel.set()
+        self._cancel = threading.Event()
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        self._pending = []
+        self._pending_index = 0
+        self._batches = None
+        self._on_done = None
+        self._replace = False
+
+    def clear(self):
+        self.cancel()
+        self.tree.delete(*self.tree.get_children())
+        self.row_count = 0
+
+    def show_rows(self, rows, on_done=None):
+        """Replace the contents with rows; on_done runs once all are shown"""
+        self.clear()
+        self.append_rows(rows, on_done)
+
+    def append_rows(self, rows, on_done=None):
+        """Add rows after the current ones"""
+        self._pending.extend(rows)
+        self._on_done = on_done
+        self._schedule(1)
+
+    def load(self, executor, job, *args, on_loaded=None, on_done=None,
+             on_error=None):
+        """Run job(*args) on executor and show the list of rows it returns
+
+        The current rows stay on screen until the result arrives.
+        on_loaded(rows) gets the full result, e.g. to save a copy.
+        """
+        generation = self._generation
+
+        def on_success(rows):
+            if generation != self._generation or not self.winfo_exists():
+                return
+            self.show_rows(rows, on_done)
+            if on_loaded:
+                on_loaded(rows)
+
+        def on_failure(error):
+            if generation != self._generation or not self.winfo_exists():
+                return
+            if on_error:
+                on_error(error)
+            else:
+                self.set_status(f"Failed to load data: {describe_error(error)}")
+
+        self.set_status("Loading...")
+        executor.submit(job, *args, on_success=on_success, on_error=on_failure)
+
+    def stream(self, executor, job, *args, on_done=None, on_error=None):
+        """Show the row batches yielded by job(*args) as they arrive
+
+        job runs on an executor worker and typically returns
+        DatabaseManager.stream(...). If the UI falls behind, the worker
+        waits instead of buffering the whole result. The current rows stay
+        on screen until the first batch arrives.
+        """
+        self.cancel()
+        generation = self._generation
+        cancel = self._cancel
+        batches = queue.Queue(maxsize=STREAM_QUEUE_BATCHES)
+        self._batches = batches
+        self._on_done = on_done
+        self._replace = True
+
+        def put(item):
+            while not cancel.is_set():
+                try:
+                    batches.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def pump():
+            source = job(*args)
+            try:
+                for batch in source:
+                    if not put(batch):
+                        return
+            finally:
+                close = getattr(source, 'close', None)
+                if close:
+                    close()
+            put(None)
+
+        def on_failure(error):
+            if generation != self._generation or not self.winfo_exists():
+                return
+            # Keep what arrived and say why the rest is missing
+            self._batches = None
+            if on_error:
+                self._on_done = lambda: on_error(error)
+            else:
+                message = f"Failed to load data: {describe_error(error)}"
+                self._on_done = lambda: self.set_status(message)
+            self._schedule(1)
+
+        self.set_status("Loading...")
+        executor.submit(pump, on_error=on_failure)
+        self._schedule(STREAM_POLL_MS)
+
+    def _schedule(self, delay_ms):
+        if self._after_id is None:
+            self._after_id = self.after(delay_ms, self._insert_chunk)
+
+    def _take_batches(self):
+        while len(self._pending) - self._pending_index < self.chunk_size:
+            try:
+                batch = self._batches.get_nowait()
+            except queue.Empty:
+                return
+            if self._replace:
+                # First answer from the stream: drop the rows it replaces
+                self._replace = False
+                self.tree.delete(*self.tree.get_children())
+                self.row_count = 0
+            if batch is None:
+                self._batches = None
+                return
+            self._pending.extend(batch)
+
+    def _insert_chunk(self):
+        self._after_id = None
+        if self._batches is not None:
+            self._take_batches()
+
+        end = min(len(self._pending), self._pending_index + self.chunk_size)
+        for index in range(self._pending_index, end):
+            self.tree.insert('', 'end', values=tuple(self._pending[index]))
+        self.row_count += end - self._pending_index
+        self._pending_index = end
+        if self._pending_index >= len(self._pending):
+            self._pending = []
+            self._pending_index = 0
+
+        if self._pending:
+            self.set_status(f"Loading... {self.row_count} record(s)")
+            self._schedule(1)
+        elif self._batches is not None:
+            if self.row_count and not self._replace:
+                self.set_status(f"Loading... {self.row_count} record(s)")
+            self._schedule(STREAM_POLL_MS)
+        else:
+            self._replace = False
+            on_done, self._on_done = self._on_done, None
+            if on_done:
+                on_done()
+            else:
+                self.set_status(f"{self.row_count} record(s)")
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.on_scroll_end and float(last) > 0.9:
+            self.on_scroll_end()
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.cancel()
@@ -0,0 +1,434 @@
+"""Form approval workflow, independent of the Tk user interface.
+
+The GUI, the benchmark harness and batch tools all go through
+WorkflowService, so the same SQL and state transitions serve every caller.
+"""
+import json
+
+from cache import LRUCache
+
+ROLES = ['Admin', 'Initiator', 'Production Head', 'Operator', 'User', 'Approver']
+
+# Review step handled by each approver role; the Production Head's
+# approval is final
+STEP_MAPPING = {'User': 2, 'Approver': 3, 'Production Head': 4}
+FINAL_ROLE = 'Production Head'
+
+# Number of pending forms an approver holds at once, and for how long.
+# Production Heads work alone at their step and clear forms in bulk.
+CLAIM_BATCH_SIZE = 20
+CLAIM_BATCH_SIZES = {'Production Head': 250}
+CLAIM_LEASE_SECONDS = 15 * 60
+
+# Form details kept in memory, keyed by (form id, updated_at)
+DETAIL_CACHE_SIZE = 256
+
+USERS_QUERY = ("SELECT id, username, role, email, is_active, created_at "
+               "FROM users ORDER BY username")
+MY_FORMS_QUERY = """
+    SELECT id, title, current_status, current_step, created_at, updated_at
+    FROM forms
+    WHERE created_by = %s
+    ORDER BY updated_at DESC
+"""
+
+
+class WorkflowError(Exception):
+    """A request the workflow rejects, with a message fit for the user"""
+
+
+class WorkflowService:
+
+    def __init__(self, db):
+        self.db = db
+        self.detail_cache = LRUCache(DETAIL_CACHE_SIZE)
+
+    def step_for_role(self, role):
+        if role not in STEP_MAPPING:
+            raise WorkflowError(f"Role {role} does not approve forms")
+        return STEP_MAPPING[role]
+
+    def login(self, username, password):
+        user = self.db.run(self.db.authenticate_user, username, password)
+        if user:
+            self.db.log_action(user['id'], "User logged in")
+        return user
+
+    def logout(self, user, timeout=5):
+        """Release the user's claims and flush their pending audit events"""
+        self.db.log_action(user['id'], "User logged out")
+        try:
+            self.release_claims(user)
+        finally:
+            self.db.flush_audit(timeout)
+
+    def submit_form(self, user, title, description, form_data,
+                    request_key=None):
+        """Create a form at the first review step and return its id.
+
+        A repeated request_key returns the form created the first time.
+        """
+        # Only a request_key lets a retry after a lost commit find the form
+        return self.db.run(self._submit_form, user, title, description,
+                           form_data, request_key,
+                           idempotent=bool(request_key))
+
+    def _submit_form(self, user, title, description, form_data, request_key):
+        if not title or form_data is None:
+            raise WorkflowError("Please fill in all required fields")
+
+        user_id = user['id']
+        with self.db.unit_of_work('submit_form') as uow:
+            if request_key:
+                uow.execute("SELECT id FROM forms WHERE request_key = %s",
+                            (request_key, ))
+                existing = uow.fetchone()
+                if existing:
+                    return existing[0]
+
+            uow.execute(
+                """
+                INSERT INTO forms
+                    (title, description, form_data, created_by, request_key)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (title, description, json.dumps(form_data), user_id,
+                  request_key))
+            form_id = uow.lastrowid
+            self.db.log_action(user_id, f"Created form: {title}", cursor=uow)
+            return form_id
+
+    def decide(self, user, form_id, action, comments="", request_key=None):
+        """Approve or reject a form waiting at the user's step.
+
+        Returns False without writing anything if the form is no longer
+        pending at that step, i.e. another client already handled it. A
+        repeated request_key returns True without applying it again.
+        """
+        return self.db.run(self._decide, user, form_id, action, comments,
+                           request_key, idempotent=bool(request_key))
+
+    def _decide(self, user, form_id, action, comments, request_key):
+        if action not in ('approved', 'rejected'):
+            raise WorkflowError(f"Unknown action: {action}")
+        step = self.step_for_role(user['role'])
+        final_step = user['role'] == FINAL_ROLE
+        user_id = user['id']
+
+        with self.db.unit_of_work('process_approval') as uow:
+            if request_key:
+                uow.execute("SELECT 1 FROM approvals WHERE request_key = %s",
+                            (request_key, ))
+                if uow.fetchone():
+                    return True
+
+            # Update form status, only if it is still waiting at the
+            # step this approver saw; otherwise someone else got there first
+            if action == 'rejected' or final_step:
+                uow.execute(
+                    """
+                    UPDATE forms
+                    SET current_status = %s, claimed_by = NULL, claim_expires_at = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND current_step = %s AND current_status = 'pending'
+                """, (action, form_id, step))
+            else:
+                uow.execute(
+                    """
+                    UPDATE forms
+                    SET current_step = %s, claimed_by = NULL, claim_expires_at = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND current_step = %s AND current_status = 'pending'
+                """, (step + 1, form_id, step))
+
+            if uow.rowcount == 0:
+                return False
+
+            # Record approval
+            uow.execute(
+                """
+                INSERT INTO approvals
+                    (form_id, user_id, step_number, action, comments, request_key)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (form_id, user_id, step, action, comments, request_key))
+
+            self.db.log_action(
+                user_id,
+                f"Form {form_id} {action} with comments: {comments}",
+                cursor=uow)
+            return True
+
+    def decide_many(self, user, form_ids, action, comments=""):
+        """Approve or reject several forms in one transaction.
+
+        Returns {form_id: True if handled, False if another client already
+        handled it}.
+        """
+        return self.db.run(self._decide_many, user, form_ids, action,
+                           comments)
+
+    def _decide_many(self, user, form_ids, action, comments):
+        if action not in ('approved', 'rejected'):
+            raise WorkflowError(f"Unknown action: {action}")
+        form_ids = sorted(set(form_ids))
+        if not form_ids:
+            return {}
+        step = self.step_for_role(user['role'])
+        final_step = user['role'] == FINAL_ROLE
+        user_id = user['id']
+
+        with self.db.unit_of_work('process_approvals') as uow:
+            self.db.backend.begin_write(uow.cursor)
+            # Lock only the forms that are still ours to decide
+            placeholders = ', '.join(['%s'] * len(form_ids))
+            uow.execute(
+                f"""
+                SELECT id FROM forms
+                WHERE id IN ({placeholders}) AND current_step = %s
+                    AND current_status = 'pending'
+                {self.db.backend.for_update}
+            """, (*form_ids, step))
+            eligible = sorted(row[0] for row in uow.fetchall())
+
+            if eligible:
+                uow.execute("SAVEPOINT decide_many")
+                self._advance_forms(uow, eligible, action, step, final_step)
+                if uow.rowcount != len(eligible):
+                    # A form changed since the SELECT after all; redo them
+                    # one at a time and record only the ones this moved
+                    uow.execute("ROLLBACK TO SAVEPOINT decide_many")
+                    moved = []
+                    for form_id in eligible:
+                        self._advance_forms(uow, [form_id], action, step,
+                                            final_step)
+                        if uow.rowcount == 1:
+                            moved.append(form_id)
+                    eligible = moved
+
+            if eligible:
+                uow.executemany(
+                    """
+                    INSERT INTO approvals
+                        (form_id, user_id, step_number, action, comments)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, [(form_id, user_id, step, action, comments)
+                      for form_id in eligible])
+
+                self.db.log_actions(
+                    [(user_id, f"Form {form_id} {action} with comments: {comments}",
+                      "Batch decision") for form_id in eligible],
+                    cursor=uow)
+
+        handled = set(eligible)
+        return {form_id: form_id in handled for form_id in form_ids}
+
+    def _advance_forms(self, uow, form_ids, action, step, final_step):
+        """Reject, finish or pass on the forms still pending at step"""
+        placeholders = ', '.join(['%s'] * len(form_ids))
+        if action == 'rejected' or final_step:
+            uow.execute(
+                f"""
+                UPDATE forms
+                SET current_status = %s, claimed_by = NULL,
+                    claim_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders}) AND current_step = %s
+                    AND current_status = 'pending'
+            """, (action, *form_ids, step))
+        else:
+            uow.execute(
+                f"""
+                UPDATE forms
+                SET current_step = %s, claimed_by = NULL,
+                    claim_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders}) AND current_step = %s
+                    AND current_status = 'pending'
+            """, (step + 1, *form_ids, step))
+
+    def list_inbox(self, user, since=None, known_ids=(), batch_size=None,
+                   lease_seconds=CLAIM_LEASE_SECONDS):
+        """Renew and top up the user's claims and return
+        (ids of all claimed forms, rows that are new or changed since `since`)"""
+        # Claiming again only renews the same user's claims
+        return self.db.run(self._list_inbox, user, since, known_ids,
+                           batch_size, lease_seconds, idempotent=True)
+
+    def _list_inbox(self, user, since, known_ids, batch_size, lease_seconds):
+        user_id = user['id']
+        step = self.step_for_role(user['role'])
+        if batch_size is None:
+            batch_size = CLAIM_BATCH_SIZES.get(user['role'], CLAIM_BATCH_SIZE)
+        lease_expiry = self.db.backend.seconds_from_now()
+        with self.db.unit_of_work('inbox') as uow:
+            uow.execute(
+                f"""
+                UPDATE forms
+                SET claim_expires_at = {lease_expiry}, updated_at = updated_at
+                WHERE claimed_by = %s AND current_step = %s
+                    AND current_status = 'pending'
+            """, (lease_seconds, user_id, step))
+            uow.execute(
+                """
+                SELECT id, updated_at FROM forms
+                WHERE claimed_by = %s AND current_step = %s
+                    AND current_status = 'pending'
+            """, (user_id, step))
+            claimed = dict(uow.fetchall())
+            wanted = batch_size - len(claimed)
+
+            if wanted > 0:
+                # Rows another client is claiming right now are skipped, not waited on
+                uow.execute(
+                    f"""
+                    SELECT id FROM forms
+                    WHERE current_step = %s AND current_status = 'pending'
+                        AND (claimed_by IS NULL OR claim_expires_at < NOW())
+                    ORDER BY id
+                    LIMIT %s
+                    {self.db.backend.skip_locked}
+                """, (step, wanted))
+                form_ids = [row[0] for row in uow.fetchall()]
+
+                if form_ids:
+                    placeholders = ', '.join(['%s'] * len(form_ids))
+                    uow.execute(
+                        f"""
+                        UPDATE forms
+                        SET claimed_by = %s,
+                            claim_expires_at = {lease_expiry},
+                            updated_at = updated_at
+                        WHERE id IN ({placeholders})
+                            AND (claimed_by IS NULL OR claim_expires_at < NOW())
+                    """, (user_id, lease_seconds, *form_ids))
+                    claimed.update((form_id, None) for form_id in form_ids)
+
+            # Only ship full rows for forms that are new to the view or have
+            # changed at or after the watermark (>= so same-second writes count)
+            fetch_ids = [
+                form_id for form_id, updated_at in claimed.items()
+                if since is None or form_id not in known_ids
+                or updated_at is None or updated_at >= since
+            ]
+            rows = []
+            if fetch_ids:
+                placeholders = ', '.join(['%s'] * len(fetch_ids))
+                uow.execute(
+                    f"""
+                    SELECT f.id, f.title, u.username, f.current_status, f.current_step,
+                        f.created_at, f.updated_at
+                    FROM forms f
+                    JOIN users u ON f.created_by = u.id
+                    WHERE f.id IN ({placeholders})
+                    ORDER BY f.id
+                """, fetch_ids)
+                rows = uow.fetchall()
+            return set(claimed), rows
+
+    def release_claims(self, user):
+        """Give back every form the user has claimed"""
+        return self.db.run(self._release_claims, user, idempotent=True)
+
+    def _release_claims(self, user):
+        user_id = user['id']
+        with self.db.unit_of_work('release_claims') as uow:
+            uow.execute(
+                """
+                UPDATE forms
+                SET claimed_by = NULL, claim_expires_at = NULL, updated_at = updated_at
+                WHERE claimed_by = %s
+            """, (user_id, ))
+
+    def get_form(self, form_id, updated_at=None):
+        """Return (form row, approval history) or (None, []) if missing.
+
+        The form row's form_data is already pretty-printed. Pass the
+        updated_at the caller last saw to serve an unchanged form from cache.
+        """
+        if updated_at is not None:
+            cached = self.detail_cache.get((form_id, updated_at))
+            if cached is not None:
+                return cached
+
+        # One round trip: the form columns repeat on every approval row
+        rows = self.db.fetch_all(
+            """
+            SELECT f.title, f.description, f.form_data, u.username, f.created_at,
+                   f.updated_at, au.username, a.action, a.comments, a.timestamp
+            FROM forms f
+            JOIN users u ON f.created_by = u.id
+            LEFT JOIN approvals a ON a.form_id = f.id
+            LEFT JOIN users au ON a.user_id = au.id
+            WHERE f.id = %s
+            ORDER BY a.timestamp, a.id
+        """, (form_id, ), name='form_detail', read_only=True)
+        if not rows:
+            return None, []
+
+        first = rows[0]
+        form = (first[0], first[1], json.dumps(json.loads(first[2]), indent=2),
+                first[3], first[4])
+        approvals = [row[6:10] for row in rows if row[7] is not None]
+        result = (form, approvals)
+        self.detail_cache.put((form_id, first[5]), result)
+        return result
+
+    def list_my_forms(self, user):
+        return self.db.fetch_all(MY_FORMS_QUERY, (user['id'], ),
+                                 name='my_forms', read_only=True)
+
+    def iter_my_forms(self, user, batch_size=500):
+        """Yield the user's forms in batches without loading all of them"""
+        return self.db.stream(MY_FORMS_QUERY, (user['id'], ), name='my_forms',
+                              batch_size=batch_size, read_only=True)
+
+    def list_users(self):
+        return self.db.fetch_all(USERS_QUERY, name='users', read_only=True)
+
+    def iter_users(self, batch_size=500):
+        """Yield the user list in batches without loading all of it"""
+        return self.db.stream(USERS_QUERY, name='users',
+                              batch_size=batch_size, read_only=True)
+
+    def create_user(self, username, password, role, email=None):
+        if not all([username, password, role]):
+            raise WorkflowError("Please fill in all required fields")
+        if role not in ROLES:
+            raise WorkflowError(f"Unknown role: {role}")
+
+        password_hash = self.db.hasher.hash(password)
+        return self.db.run(self._insert_user, username, password_hash, role,
+                           email)
+
+    def _insert_user(self, username, password_hash, role, email):
+        with self.db.unit_of_work('create_user') as uow:
+            uow.execute(
+                """
+                INSERT INTO users (username, password_hash, role, email)
+                VALUES (%s, %s, %s, %s)
+            """, (username, password_hash, role, email))
+            return uow.lastrowid
+
+    def audit_page(self, before=None, limit=100):
+        """Fetch audit entries older than the (timestamp, id) key `before`"""
+        if before is None:
+            return self.db.fetch_all(
+                """
+                SELECT a.id, u.username, a.action, a.details, a.timestamp
+                FROM audit_log a
+                JOIN users u ON a.user_id = u.id
+                ORDER BY a.timestamp DESC, a.id DESC
+                LIMIT %s
+            """, (limit, ), name='audit_page', read_only=True)
+
+        timestamp, entry_id = before
+        return self.db.fetch_all(
+            """
+            SELECT a.id, u.username, a.action, a.details, a.timestamp
+            FROM audit_log a
+            JOIN users u ON a.user_id = u.id
+            WHERE a.timestamp < %s OR (a.timestamp = %s AND a.id < %s)
+            ORDER BY a.timestamp DESC, a.id DESC
+            LIMIT %s
+        """, (timestamp, timestamp, entry_id, limit),
+                                 name='audit_page',
+                                 read_only=True)